@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import os
 import string
 import hashlib
+import hmac
 import secrets
 from hmac import compare_digest
 from dotenv import load_dotenv
@@ -22,6 +23,9 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
+# Key for OTP hashing; falls back to SECRET_KEY when no dedicated secret is configured
+OTP_SECRET = (os.environ.get("OTP_SECRET") or SECRET_KEY).encode()
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -29,8 +33,9 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def hash_otp(otp: str) -> str:
-    """Hash OTP before storing in database using PBKDF2"""
-    return hashlib.pbkdf2_hmac('sha256', otp.encode(), b'otp_salt', 100000).hex()
+    """Hash OTP before storing in database using keyed HMAC-SHA256.
+    OTPs are short-lived and single-use, so a slow KDF only burns request CPU."""
+    return hmac.new(OTP_SECRET, otp.encode(), hashlib.sha256).hexdigest()
 
 def verify_otp(plain_otp: str, hashed_otp: str) -> bool:
     """Verify OTP against hashed version using constant-time comparison"""
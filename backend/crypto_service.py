@@ -188,6 +188,25 @@ class CryptoService:
             logger.error(f"File decryption failed: {e}")
             raise
     
+    @staticmethod
+    def new_stream_encryptor(key: bytes):
+        """
+        Start incremental encryption producing the same layout as encrypt_file
+        Feed plaintext through cipher.encrypt() in order; store cipher.nonce + cipher.digest() + ciphertext.
+        """
+        return AES.new(key, AES.MODE_GCM)
+    
+    @staticmethod
+    def new_stream_decryptor(key: bytes, header: bytes):
+        """
+        Start incremental decryption of data produced by encrypt_file
+        Takes the leading nonce + tag header; returns (cipher, tag).
+        Feed the ciphertext through cipher.decrypt() in order, then call cipher.verify(tag).
+        """
+        nonce = header[:CryptoService.AES_NONCE_SIZE]
+        tag = header[CryptoService.AES_NONCE_SIZE:CryptoService.AES_NONCE_SIZE + CryptoService.AES_TAG_SIZE]
+        return AES.new(key, AES.MODE_GCM, nonce=nonce), tag
+    
     @staticmethod
     def encrypt_hybrid(file_data: bytes, public_key: bytes = None) -> Dict[str, str]:
         """
@@ -7,17 +7,23 @@ Separates file management logic from API endpoints
 import io
 import time
 import logging
+import tempfile
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Callable
 from bson import ObjectId
 
 logger = logging.getLogger(__name__)
 
+# Read/encrypt/decrypt granularity when streaming files into and out of GridFS
+STREAM_CHUNK_SIZE = 256 * 1024
+# Encrypted uploads are staged in memory up to this size, then spill to a temp file
+UPLOAD_SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
 
 class FileService:
     """Service for managing file operations including encryption/decryption"""
     
-    def __init__(self, fs, db, crypto_service):
+    def __init__(self, fs, db, crypto_service, log_writer: Optional[Callable[[Dict[str, Any]], None]] = None):
         """
         Initialize FileService
         
@@ -25,14 +31,17 @@ class FileService:
             fs: GridFS instance for file storage
             db: MongoDB database instance
             crypto_service: CryptoService instance for encryption/decryption
+            log_writer: Optional callable that takes over writing access-log documents
+                (e.g. a background audit queue); defaults to a direct insert
         """
         self.fs = fs
         self.db = db
         self.crypto_service = crypto_service
+        self.log_writer = log_writer
     
     async def upload_file(
         self, 
-        file_content: bytes,
+        file_content: Optional[bytes],
         filename: str,
         uploaded_by: str,
         file_object=None
@@ -41,37 +50,37 @@ class FileService:
         Upload and encrypt a file
         
         Args:
-            file_content: Raw file content bytes
+            file_content: Raw file content bytes (None to stream from file_object)
             filename: Name of the file
             uploaded_by: Username of the uploader
-            file_object: Optional file object for direct upload
+            file_object: Optional async file object (e.g. UploadFile), read and encrypted in chunks
             
         Returns:
             Dictionary containing file_id, filename, and metadata with timing info
         """
         start_total = time.perf_counter()
+        encryption_key = self.crypto_service.generate_key()
         
-        # Read file content if not provided
-        if file_object and not file_content:
-            start = time.perf_counter()
-            file_content = await file_object.read()
-            read_time = time.perf_counter() - start
+        if file_object is not None and not file_content:
+            file_id, size, read_time, encrypt_time, store_time = await self._upload_stream(
+                file_object, filename, encryption_key
+            )
         else:
             read_time = 0
-        
-        # Encrypt file
-        start = time.perf_counter()
-        encryption_key = self.crypto_service.generate_key()
-        encrypted_content = self.crypto_service.encrypt_file(file_content, encryption_key)
-        encrypt_time = time.perf_counter() - start
-        
-        # Store in GridFS
-        start = time.perf_counter()
-        file_id = await self.fs.upload_from_stream(
-            filename,
-            encrypted_content
-        )
-        store_time = time.perf_counter() - start
+            size = len(file_content)
+            
+            # Encrypt file
+            start = time.perf_counter()
+            encrypted_content = self.crypto_service.encrypt_file(file_content, encryption_key)
+            encrypt_time = time.perf_counter() - start
+            
+            # Store in GridFS
+            start = time.perf_counter()
+            file_id = await self.fs.upload_from_stream(
+                filename,
+                encrypted_content
+            )
+            store_time = time.perf_counter() - start
         
         total_time = time.perf_counter() - start_total
         
@@ -82,7 +91,7 @@ class FileService:
             "uploaded_by": uploaded_by,
             "uploaded_at": datetime.now(timezone.utc).isoformat(),
             "encrypted": True,
-            "size": len(file_content),
+            "size": size,
             "encryption_key": self.crypto_service.key_to_string(encryption_key),
             "timings_ms": {
                 "read_ms": round(read_time * 1000, 3),
@@ -103,6 +112,48 @@ class FileService:
             "timings_ms": metadata["timings_ms"]
         }
     
+    async def _upload_stream(self, file_object, filename: str, key: bytes) -> tuple:
+        """
+        Encrypt file_object chunk by chunk and store it in GridFS with O(chunk) memory
+        
+        The stored layout (nonce + tag + ciphertext) needs the tag first, which is only known
+        after the last chunk, so ciphertext is staged in a spooled temp file and then copied.
+        
+        Returns:
+            Tuple of (gridfs_id, plaintext_size, read_s, encrypt_s, store_s)
+        """
+        cipher = self.crypto_service.new_stream_encryptor(key)
+        size = 0
+        read_time = encrypt_time = 0.0
+        
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE) as spool:
+            while True:
+                start = time.perf_counter()
+                chunk = await file_object.read(STREAM_CHUNK_SIZE)
+                read_time += time.perf_counter() - start
+                if not chunk:
+                    break
+                size += len(chunk)
+                start = time.perf_counter()
+                spool.write(cipher.encrypt(chunk))
+                encrypt_time += time.perf_counter() - start
+            header = cipher.nonce + cipher.digest()
+            spool.seek(0)
+            
+            start = time.perf_counter()
+            grid_in = self.fs.open_upload_stream(filename)
+            try:
+                await grid_in.write(header)
+                while chunk := spool.read(STREAM_CHUNK_SIZE):
+                    await grid_in.write(chunk)
+                await grid_in.close()
+            except Exception:
+                await grid_in.abort()
+                raise
+            store_time = time.perf_counter() - start
+        
+        return grid_in._id, size, read_time, encrypt_time, store_time
+    
     async def list_files(
         self,
         uploaded_by: Optional[str] = None,
@@ -207,6 +258,66 @@ class FileService:
             "media_type": media_type
         }
     
+    async def stream_file(self, file_id: str) -> Dict[str, Any]:
+        """
+        Open a file for streaming decryption without holding it in memory
+        
+        The GCM tag is verified in a first pass over the ciphertext (plaintext discarded),
+        so no unauthenticated bytes are ever sent; a second pass decrypts and yields chunks.
+        Files that fit in one chunk are read and decrypted in a single pass.
+        
+        Args:
+            file_id: ID of the file
+            
+        Returns:
+            Dictionary with content (async iterator of bytes), filename, media_type and size
+            
+        Raises:
+            ValueError: If file not found or fails authentication
+        """
+        file_meta = await self.get_file_metadata(file_id)
+        if not file_meta:
+            raise ValueError(f"File {file_id} not found")
+        
+        grid_id = ObjectId(file_meta["file_id"])
+        key = self.crypto_service.string_to_key(file_meta["encryption_key"])
+        header_size = self.crypto_service.AES_NONCE_SIZE + self.crypto_service.AES_TAG_SIZE
+        filename = file_meta["filename"]
+        
+        grid_out = await self.fs.open_download_stream(grid_id)
+        size = grid_out.length - header_size
+        
+        if grid_out.length <= header_size + STREAM_CHUNK_SIZE:
+            plaintext = self.crypto_service.decrypt_file(await grid_out.read(), key)
+            content = self._iter_bytes(plaintext)
+        else:
+            # Pass 1: authenticate the whole ciphertext before releasing any plaintext
+            cipher, tag = self.crypto_service.new_stream_decryptor(key, await grid_out.read(header_size))
+            while chunk := await grid_out.read(STREAM_CHUNK_SIZE):
+                cipher.decrypt(chunk)
+            cipher.verify(tag)
+            content = self._iter_decrypted(grid_id, key, header_size)
+        
+        logger.info(f"File streamed: {file_id}")
+        
+        return {
+            "content": content,
+            "filename": filename,
+            "media_type": self._get_media_type(filename),
+            "size": size
+        }
+    
+    async def _iter_decrypted(self, grid_id: ObjectId, key: bytes, header_size: int) -> AsyncIterator[bytes]:
+        """Pass 2 of stream_file: decrypt already-verified ciphertext chunk by chunk"""
+        grid_out = await self.fs.open_download_stream(grid_id)
+        cipher, _ = self.crypto_service.new_stream_decryptor(key, await grid_out.read(header_size))
+        while chunk := await grid_out.read(STREAM_CHUNK_SIZE):
+            yield cipher.decrypt(chunk)
+    
+    @staticmethod
+    async def _iter_bytes(data: bytes) -> AsyncIterator[bytes]:
+        yield data
+    
     def _get_media_type(self, filename: str) -> str:
         """
         Determine media type based on file extension
@@ -283,7 +394,10 @@ class FileService:
         if wfh_request_id:
             log["wfh_request_id"] = wfh_request_id
         
-        await self.db.access_logs.insert_one(log)
+        if self.log_writer:
+            self.log_writer(log)
+        else:
+            await self.db.access_logs.insert_one(log)
         
         logger.info(f"File access logged: {file_id} by {employee_username}, success={success}")
     
@@ -322,7 +436,7 @@ class FileService:
         total_files = await self.db.file_metadata.count_documents({})
         
         # Get total size
-        stats = await self.db.file_metadata.aggregate([
+        cursor = await self.db.file_metadata.aggregate([
             {
                 "$group": {
                     "_id": None,
@@ -330,7 +444,8 @@ class FileService:
                     "file_count": {"$sum": 1}
                 }
             }
-        ]).to_list(1)
+        ])
+        stats = await cursor.to_list(1)
         
         if stats:
             total_size = stats[0].get("total_size", 0)
@@ -1,10 +1,16 @@
 from math import radians, sin, cos, sqrt, atan2
 from datetime import datetime, time
 from typing import Tuple, Dict
+from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=64)
+def _parse_hhmm(value: str) -> time:
+    """Parse an HH:MM config value (cached: the configured window rarely changes)"""
+    return datetime.strptime(value, "%H:%M").time()
+
 class GeofenceValidator:
     """
     Validate employee access based on geofencing, WiFi, and time conditions
@@ -68,8 +74,8 @@ class GeofenceValidator:
         """
         # Parse HH:MM into time objects and compare current local time
         try:
-            start_obj = datetime.strptime(start_time, "%H:%M").time()
-            end_obj = datetime.strptime(end_time, "%H:%M").time()
+            start_obj = _parse_hhmm(start_time)
+            end_obj = _parse_hhmm(end_time)
         except Exception as e:
             logger.error(f"Invalid time format in geofence config: {e}")
             return False, f"Invalid time format in config: {start_time}-{end_time}"
@@ -1,12 +1,27 @@
 from sklearn.ensemble import IsolationForest
 from collections import defaultdict, Counter
 import numpy as np
+import pandas as pd
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Hashable
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
+# IsolationForest tuning. max_samples "auto" subsamples min(256, n) rows per tree;
+# n_jobs > 1 (or -1 for all cores) parallelizes tree building for large training sets.
+ANOMALY_N_ESTIMATORS = int(os.environ.get('ANOMALY_N_ESTIMATORS', '100'))
+ANOMALY_MAX_SAMPLES = os.environ.get('ANOMALY_MAX_SAMPLES', 'auto')
+ANOMALY_N_JOBS = int(os.environ.get('ANOMALY_N_JOBS', '1'))
+
+def _parse_max_samples(value: str):
+    """'auto', an absolute row count ("512") or a fraction of the data ("0.5")"""
+    if value == 'auto':
+        return value
+    return float(value) if '.' in value else int(value)
+
 class AnomalyDetector:
     """
     ML-based anomaly detection for employee behavior and access patterns
@@ -20,7 +35,9 @@ class AnomalyDetector:
         self.model = IsolationForest(
             contamination=0.1,
             random_state=42,
-            n_estimators=100
+            n_estimators=ANOMALY_N_ESTIMATORS,
+            max_samples=_parse_max_samples(ANOMALY_MAX_SAMPLES),
+            n_jobs=ANOMALY_N_JOBS
         )
         self.is_trained = False
         self.employee_profiles = {}  # Store normal patterns per employee
@@ -38,45 +55,30 @@ class AnomalyDetector:
         if not activities:
             return np.array([])
         
-        features = []
-        for i, activity in enumerate(activities):
-            timestamp = activity.get('timestamp')
-            if isinstance(timestamp, str):
-                try:
-                    timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                except:
-                    timestamp = datetime.now(timezone.utc)
-            elif isinstance(timestamp, datetime) and timestamp.tzinfo is None:
-                timestamp = timestamp.replace(tzinfo=timezone.utc)
-            
-            hour = timestamp.hour
-            day_of_week = timestamp.weekday()
-            is_failed = 0 if activity.get('success', True) else 1
-            
-            # Time since last access (normalized to hours)
-            time_since_last = 0
-            if i > 0:
-                prev_timestamp = activities[i-1].get('timestamp')
-                if isinstance(prev_timestamp, str):
-                    try:
-                        prev_timestamp = datetime.fromisoformat(prev_timestamp.replace('Z', '+00:00'))
-                    except:
-                        prev_timestamp = timestamp
-                if isinstance(prev_timestamp, datetime) and prev_timestamp.tzinfo is None:
-                    prev_timestamp = prev_timestamp.replace(tzinfo=timezone.utc)
-                
-                time_diff = (timestamp - prev_timestamp).total_seconds() / 3600
-                time_since_last = min(time_diff, 24)  # Cap at 24 hours
-            
-            features.append([
-                hour,
-                day_of_week,
-                is_failed,
-                time_since_last,
-                1  # access count
-            ])
+        n = len(activities)
+        # Parse every timestamp in one pass (ISO strings or datetimes, normalized to UTC);
+        # unparseable values fall back to "now"
+        parsed = pd.to_datetime(
+            pd.Series([a.get('timestamp') for a in activities], dtype=object),
+            utc=True, errors='coerce', format='ISO8601'
+        )
+        timestamps = parsed.fillna(pd.Timestamp.now(tz='UTC'))
+        
+        is_failed = np.fromiter((0 if a.get('success', True) else 1 for a in activities), dtype=np.float32, count=n)
         
-        return np.array(features) if features else np.array([]).reshape(0, 5)
+        # Time since previous entry in hours, capped at 24 (0 for the first entry or an unparseable predecessor)
+        time_since_last = (timestamps - timestamps.shift(1)).dt.total_seconds().to_numpy() / 3600
+        time_since_last[parsed.shift(1).isna().to_numpy()] = 0
+        time_since_last = np.minimum(time_since_last, 24)
+        
+        # float32 is what sklearn's tree code works in, so fit/score skip a conversion copy
+        return np.column_stack([
+            timestamps.dt.hour.to_numpy(),
+            timestamps.dt.dayofweek.to_numpy(),
+            is_failed,
+            time_since_last,
+            np.ones(n)  # access count
+        ]).astype(np.float32)
     
     def train(self, activities: List[Dict]) -> bool:
         """
@@ -100,6 +102,30 @@ class AnomalyDetector:
             logger.error(f"Training failed: {e}")
             return False
     
+    def score_batch(self, activities: List[Dict]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Score logs independently as they are written (insert-time scoring)
+        There is no neighbouring context at insert time, so the time-since-last feature is 0.
+        Returns (scores, is_anomaly) or None if the model is not trained.
+        Lower scores are more anomalous, as with IsolationForest.score_samples.
+        """
+        if not self.is_trained or not activities:
+            return None
+        
+        features = self.extract_features(activities)
+        features[:, 3] = 0
+        scores = self.model.score_samples(features)
+        # Same threshold predict() applies: decision_function = score_samples - offset_
+        return scores, scores < self.model.offset_
+    
+    def score_one(self, activity: Dict) -> Optional[Tuple[float, bool]]:
+        """Score a single log; see score_batch"""
+        result = self.score_batch([activity])
+        if result is None:
+            return None
+        scores, flags = result
+        return float(scores[0]), bool(flags[0])
+    
     def detect_statistical_anomalies(self, activities: List[Dict]) -> Dict[str, any]:
         """
         Detect statistical anomalies using Isolation Forest
@@ -347,3 +373,80 @@ class AnomalyDetector:
             "recommendations": recommendations,
             "analysis_timestamp": datetime.now(timezone.utc).isoformat()
         }
+
+    def analyze_employee_behavior(self, activities: List[Dict]) -> Dict:
+        """
+        Behaviour profile for a single employee's activity logs
+        Combines the activity profile (typical hours, failure rate) with statistical
+        and rule-based findings
+        """
+        if not activities:
+            return {
+                "total_activities": 0,
+                "failed_count": 0,
+                "failure_rate": 0,
+                "typical_hours": [],
+                "risk_level": "low",
+                "anomalies": [],
+                "suspicious_activities": [],
+                "analysis_timestamp": datetime.now(timezone.utc).isoformat()
+            }
+
+        stat_results = self.detect_statistical_anomalies(activities)
+        stat_anomalies = [a for a in stat_results.get("anomalies", []) if a.get("is_anomaly")]
+        rule_anomalies = self.detect_rule_based_suspicious_activities(activities)
+
+        failed_count = sum(1 for a in activities if not a.get('success', True))
+        failure_rate = failed_count / len(activities)
+        hours = Counter(int(h) for h in self.extract_features(activities)[:, 0])
+
+        risk_ratio = (len(stat_anomalies) + len(rule_anomalies)) / len(activities)
+        if risk_ratio > 0.2 or failure_rate > 0.3:
+            risk_level = "high"
+        elif risk_ratio > 0.1 or failure_rate > 0.15:
+            risk_level = "medium"
+        else:
+            risk_level = "low"
+
+        return {
+            "total_activities": len(activities),
+            "failed_count": failed_count,
+            "failure_rate": failure_rate,
+            "typical_hours": [hour for hour, _ in hours.most_common(3)],
+            "risk_level": risk_level,
+            "anomalies": stat_anomalies[:10],
+            "suspicious_activities": rule_anomalies[:20],
+            "analysis_timestamp": datetime.now(timezone.utc).isoformat()
+        }
+
+
+class TrainedModelCache:
+    """
+    TTL cache of fitted AnomalyDetector instances.
+    Each entry is stored under a scope (e.g. all logs, or one employee) together with a
+    fingerprint of its training set; a lookup only hits when the fingerprint still matches
+    and the entry is younger than the TTL, so the model is refit only when data changes.
+    """
+    
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[Hashable, float, AnomalyDetector]] = {}
+    
+    def get(self, scope: Hashable, fingerprint: Hashable) -> Optional[AnomalyDetector]:
+        """Return the cached detector for scope if it was trained on the same fingerprint"""
+        entry = self._entries.get(scope)
+        if entry is None:
+            return None
+        cached_fingerprint, trained_at, detector = entry
+        if cached_fingerprint != fingerprint or time.monotonic() - trained_at > self.ttl_seconds:
+            self._entries.pop(scope, None)
+            return None
+        return detector
+    
+    def put(self, scope: Hashable, fingerprint: Hashable, detector: AnomalyDetector) -> None:
+        """Store a freshly trained detector, evicting the oldest entry when full"""
+        if scope not in self._entries and len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k][1])
+            self._entries.pop(oldest, None)
+        self._entries[scope] = (fingerprint, time.monotonic(), detector)
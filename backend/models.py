@@ -15,7 +15,7 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
     otp: Optional[str] = None
-    otp_expiry: Optional[datetime] = None
+    otp_expiry: Optional[int] = None  # epoch seconds
     otp_sent_at: Optional[datetime] = None
 
 class UserCreate(BaseModel):
@@ -1,20 +1,25 @@
 from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Header, Response, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse, JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import motor.motor_asyncio
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.collation import Collation
+from gridfs import AsyncGridFSBucket
 import os
+import asyncio
 import logging
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
-import io
 import time
-from typing import Optional, List
+from typing import Optional, List, NamedTuple
 from contextlib import asynccontextmanager
-from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
 import re
 from hmac import compare_digest
+import orjson
 
 from models import (
     UserRole, User, UserCreate, LoginRequest, OTPVerifyRequest, ResendOTPRequest,
@@ -27,7 +32,7 @@ from auth import hash_password, verify_password, create_access_token, verify_tok
 from email_service import send_otp_email
 from crypto_service import CryptoService
 from geofence import GeofenceValidator
-from ml_service import AnomalyDetector
+from ml_service import AnomalyDetector, TrainedModelCache
 from wifi_service import WiFiService
 from file_service import FileService, FilePermissionValidator
 
@@ -44,18 +49,86 @@ fs = None
 crypto_service = CryptoService()
 geofence_validator = GeofenceValidator()
 anomaly_detector = AnomalyDetector()
+# Fitted models reused across admin analytics requests until the logs change (5 min TTL)
+model_cache = TrainedModelCache(ttl_seconds=300)
+# anomaly_detector is also the insert-time scoring model: refit in the background and swapped in
+ANOMALY_REFIT_SECONDS = int(os.environ.get('ANOMALY_REFIT_SECONDS', '300'))
+anomaly_refit_task: Optional[asyncio.Task] = None
 file_service = None
 file_permission_validator = None
 
-# Rate limiting storage
-login_attempts = defaultdict(list)
+# Thread pool for CPU-bound work (model training/scoring) so it never blocks the event loop.
+# sklearn/numpy release the GIL in their native code, so threads scale across cores.
+CPU_POOL_WORKERS = int(os.environ.get('CPU_POOL_WORKERS', str(os.cpu_count() or 1)))
+cpu_pool: Optional[ThreadPoolExecutor] = None
+
+# Access-log fields read by AnomalyDetector (features and rules) and shown with its findings
+ANALYSIS_LOG_PROJECTION = {
+    "_id": 0, "timestamp": 1, "employee_username": 1, "success": 1,
+    "action": 1, "log_type": 1, "location": 1
+}
+
+# Audit logging: handlers enqueue access-log documents and a fixed pool of
+# workers batches them into Mongo, so request latency never waits on the write
+AUDIT_QUEUE_MAXSIZE = int(os.environ.get('AUDIT_QUEUE_MAXSIZE', '10000'))
+AUDIT_WORKERS = int(os.environ.get('AUDIT_WORKERS', '4'))
+AUDIT_BATCH_SIZE = 100
+AUDIT_BATCH_WAIT_SECONDS = 0.05
+audit_queue: Optional[asyncio.Queue] = None
+audit_workers: List[asyncio.Task] = []
+
+# Optional size bound for access_logs (MiB). 0 keeps the collection unbounded (full audit history);
+# a positive value turns it into a capped collection that keeps only the newest entries.
+ACCESS_LOGS_CAP_MB = int(os.environ.get('ACCESS_LOGS_CAP_MB', '0'))
+
+class ConfigCache:
+    """
+    In-process copy of a singleton config document.
+    invalidate() bumps version, so a load that raced with an update is not stored.
+    """
+    
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.value = None
+        self.version = 0
+        self.expires_at = 0.0
+    
+    def fresh(self) -> bool:
+        return self.expires_at > time.monotonic()
+    
+    def store(self, value, version: int):
+        if version == self.version:
+            self.value = value
+            self.expires_at = time.monotonic() + self.ttl_seconds
+    
+    def invalidate(self):
+        self.version += 1
+        self.value = None
+        self.expires_at = 0.0
+
+# Geofence config is read on every file list/access; keep it in-process.
+# Admin updates invalidate it on this worker, a change stream invalidates it on the others
+# (replica sets only), and the TTL bounds staleness when change streams are unavailable.
+GEOFENCE_CONFIG_TTL_SECONDS = float(os.environ.get('GEOFENCE_CONFIG_TTL_SECONDS', '30'))
+geofence_config_cache = ConfigCache(GEOFENCE_CONFIG_TTL_SECONDS)
+geofence_config_watcher: Optional[asyncio.Task] = None
+
+# Case-insensitive matching for username lookups on the auth endpoints
+USERNAME_COLLATION = Collation(locale="en", strength=2)
+
+# OTP lifetime (stored as epoch seconds)
+OTP_EXPIRY_SECONDS = 300
+
+# Rate limiting storage: per-identifier sliding windows of monotonic timestamps.
+# Each deque holds at most MAX entries, so appending evicts the oldest attempt.
 RATE_LIMIT_MAX_ATTEMPTS = int(os.environ.get('RATE_LIMIT_MAX_ATTEMPTS', '5'))
 RATE_LIMIT_WINDOW_MINUTES = int(os.environ.get('RATE_LIMIT_WINDOW_MINUTES', '15'))
+login_attempts = defaultdict(lambda: deque(maxlen=RATE_LIMIT_MAX_ATTEMPTS))
 
 # IP-based rate limiting for general API requests
 IP_RATE_LIMIT_MAX_REQUESTS = int(os.environ.get('IP_RATE_LIMIT_MAX_REQUESTS', '100'))
 IP_RATE_LIMIT_WINDOW_MINUTES = int(os.environ.get('IP_RATE_LIMIT_WINDOW_MINUTES', '1'))
-ip_request_attempts = defaultdict(list)
+ip_request_attempts = defaultdict(lambda: deque(maxlen=IP_RATE_LIMIT_MAX_REQUESTS))
 
 # Token blacklist for logout functionality
 token_blacklist = set()
@@ -64,65 +137,79 @@ token_blacklist = set()
 csrf_tokens = {}
 
 # Redis support (optional - for distributed token blacklist)
+# The async client and its connection pool are created during startup (see init_redis)
 redis_client = None
 REDIS_ENABLED = False
-try:
-    import redis
-    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
-    redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-    redis_client.ping()  # Test connection
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
+
+async def init_redis():
+    """Connect the shared async Redis pool; fall back to in-memory state if unavailable"""
+    global redis_client, REDIS_ENABLED
+    if not REDIS_URL:
+        logger.info("REDIS_URL not set - using in-memory token blacklist")
+        return
+    client_candidate = None
+    try:
+        import redis.asyncio as aioredis
+        client_candidate = aioredis.from_url(REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS)
+        await client_candidate.ping()  # Test connection
+    except Exception as e:
+        logger.warning(f"Redis unavailable ({e}) - using in-memory token blacklist")
+        if client_candidate is not None:
+            await client_candidate.aclose()
+        return
+    redis_client = client_candidate
     REDIS_ENABLED = True
-    logger_setup = logging.getLogger(__name__)
-    logger_setup.info("✅ Redis connected for token blacklist persistence")
-except Exception as e:
-    REDIS_ENABLED = False
-    # Fallback to in-memory blacklist (logged during startup)
+    logger.info("✅ Redis connected for token blacklist persistence")
 
-def is_token_blacklisted(token: str) -> bool:
+async def is_token_blacklisted(token: str) -> bool:
     """Check if token is blacklisted (logged out)"""
     if REDIS_ENABLED:
-        return redis_client.exists(f"blacklist:{token}") > 0
+        return await redis_client.exists(f"blacklist:{token}") > 0
     return token in token_blacklist
 
-def blacklist_token(token: str):
+async def blacklist_token(token: str):
     """Add token to blacklist on logout"""
     if REDIS_ENABLED:
         # Store in Redis with expiration matching JWT expiry (30 minutes)
-        redis_client.setex(f"blacklist:{token}", 1800, "1")
+        await redis_client.setex(f"blacklist:{token}", 1800, "1")
     else:
         token_blacklist.add(token)
 
-def check_rate_limit(identifier: str) -> bool:
-    """Check if user has exceeded rate limit. Returns True if allowed, False if blocked."""
-    now = datetime.now(timezone.utc)
-    cutoff = now - timedelta(minutes=RATE_LIMIT_WINDOW_MINUTES)
-    
-    # Clean old attempts
-    login_attempts[identifier] = [attempt for attempt in login_attempts[identifier] if attempt > cutoff]
-    
-    # Check if exceeded limit
-    if len(login_attempts[identifier]) >= RATE_LIMIT_MAX_ATTEMPTS:
+def _allow_in_window(attempts: deque, window_seconds: float) -> bool:
+    """
+    Sliding-window check in O(1): the window is exhausted only when the deque is full
+    and its oldest entry is still inside the window. Allowed attempts are recorded.
+    """
+    now = time.monotonic()
+    if len(attempts) == attempts.maxlen and attempts[0] > now - window_seconds:
         return False
-    
-    # Record this attempt
-    login_attempts[identifier].append(now)
+    attempts.append(now)
     return True
 
-def check_ip_rate_limit(ip_address: str) -> bool:
-    """Check if IP has exceeded request rate limit."""
-    now = datetime.now(timezone.utc)
-    cutoff = now - timedelta(minutes=IP_RATE_LIMIT_WINDOW_MINUTES)
-    
-    # Clean old attempts
-    ip_request_attempts[ip_address] = [attempt for attempt in ip_request_attempts[ip_address] if attempt > cutoff]
-    
-    # Check if exceeded limit (100 requests per minute per IP)
-    if len(ip_request_attempts[ip_address]) >= IP_RATE_LIMIT_MAX_REQUESTS:
-        return False
-    
-    # Record this attempt
-    ip_request_attempts[ip_address].append(now)
-    return True
+def check_rate_limit(identifier: str) -> bool:
+    """Check if user has exceeded rate limit. Returns True if allowed, False if blocked."""
+    return _allow_in_window(login_attempts[identifier], RATE_LIMIT_WINDOW_MINUTES * 60)
+
+async def check_ip_rate_limit(ip_address: str) -> bool:
+    """
+    Check if IP has exceeded request rate limit.
+    With Redis this is a fixed-window counter shared by all workers; otherwise a per-process sliding window.
+    """
+    window_seconds = IP_RATE_LIMIT_WINDOW_MINUTES * 60
+    if REDIS_ENABLED:
+        key = f"ratelimit:ip:{ip_address}"
+        try:
+            # Create the counter with its TTL only if absent, then count this request (one atomic round-trip)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(key, 0, ex=window_seconds, nx=True)
+                pipe.incr(key)
+                _, count = await pipe.execute()
+            return count <= IP_RATE_LIMIT_MAX_REQUESTS
+        except Exception as e:
+            logger.warning(f"Redis rate limit check failed ({e}) - using in-memory limiter")
+    return _allow_in_window(ip_request_attempts[ip_address], window_seconds)
 
 def get_client_ip(request) -> str:
     """Extract client IP from request, considering proxies"""
@@ -135,13 +222,17 @@ def get_client_ip(request) -> str:
     # Direct connection
     return request.client.host if request.client else "unknown"
 
+# Input validation patterns, compiled once at import
+_USERNAME_RE = re.compile(r'[a-zA-Z0-9_]{3,20}')
+_EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+
 def validate_username(username: str) -> bool:
     """Validate username format to prevent injection"""
-    return bool(re.match(r'^[a-zA-Z0-9_]{3,20}$', username))
+    return _USERNAME_RE.fullmatch(username) is not None
 
 def validate_email(email: str) -> bool:
     """Validate email format"""
-    return bool(re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email))
+    return _EMAIL_RE.fullmatch(email) is not None
 
 # Initialize admin account and config
 async def init_admin():
@@ -185,33 +276,195 @@ async def init_admin():
     except Exception as e:
         logger.error(f"Error initializing admin: {e}")
 
+def enqueue_audit_log(log: dict):
+    """Queue an access-log document for insertion; drops it (bounded memory) if the queue is full"""
+    try:
+        audit_queue.put_nowait(log)
+    except asyncio.QueueFull:
+        logger.error(f"Audit queue full - dropping {log.get('action')} log for {log.get('employee_username')}")
+
+async def _drain_upto(queue: asyncio.Queue, first: dict, max_items: int, max_wait: float) -> List[dict]:
+    """Collect up to max_items queued documents, waiting at most max_wait seconds for stragglers"""
+    batch = [first]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait
+    while len(batch) < max_items:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def _score_audit_batch(batch: List[dict]):
+    """Attach anomaly_score/is_anomaly from the current scoring model (skipped until its first fit)"""
+    detector = anomaly_detector
+    if not detector.is_trained:
+        return
+    try:
+        result = await run_cpu_bound(detector.score_batch, batch)
+    except Exception as e:
+        logger.error(f"Failed to score {len(batch)} audit logs: {e}")
+        return
+    if result is None:
+        return
+    scores, flags = result
+    for log, score, flag in zip(batch, scores, flags):
+        log["anomaly_score"] = float(score)
+        log["is_anomaly"] = bool(flag)
+
+async def _audit_worker():
+    """Consume the audit queue, score each batch and write it with one insert_many"""
+    while True:
+        first = await audit_queue.get()
+        batch = await _drain_upto(audit_queue, first, AUDIT_BATCH_SIZE, AUDIT_BATCH_WAIT_SECONDS)
+        try:
+            await _score_audit_batch(batch)
+            await db.access_logs.insert_many(batch, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} audit logs: {e}")
+        finally:
+            for _ in batch:
+                audit_queue.task_done()
+
+async def start_audit_workers():
+    global audit_queue, audit_workers
+    audit_queue = asyncio.Queue(maxsize=AUDIT_QUEUE_MAXSIZE)
+    audit_workers = [asyncio.create_task(_audit_worker()) for _ in range(AUDIT_WORKERS)]
+
+async def stop_audit_workers():
+    """Let workers flush queued logs, then cancel them"""
+    try:
+        await asyncio.wait_for(audit_queue.join(), timeout=5)
+    except asyncio.TimeoutError:
+        logger.warning(f"Audit queue not drained on shutdown ({audit_queue.qsize()} logs pending)")
+    for worker in audit_workers:
+        worker.cancel()
+    await asyncio.gather(*audit_workers, return_exceptions=True)
+
+async def _anomaly_refit_loop():
+    """Periodically refit the scoring model on recent logs and swap it in"""
+    global anomaly_detector
+    while True:
+        try:
+            logs = await db.access_logs.find({}, ANALYSIS_LOG_PROJECTION).sort("timestamp", -1).batch_size(2000).to_list(2000)
+            if len(logs) >= 50:
+                detector = AnomalyDetector()
+                if await run_cpu_bound(detector.train, logs):
+                    anomaly_detector = detector
+        except Exception as e:
+            logger.error(f"Anomaly model refit failed: {e}")
+        await asyncio.sleep(ANOMALY_REFIT_SECONDS)
+
+async def init_indexes():
+    """Create the indexes backing hot query paths (idempotent)"""
+    try:
+        # Exact lookups by canonical username (token resolution, updates)
+        await db.users.create_index([("username", 1)])
+        # Case-insensitive lookups used by the auth endpoints
+        await db.users.create_index([("username", 1)], name="username_ci", collation=USERNAME_COLLATION)
+        # WFH lookups: equality on employee/status, newest approval first
+        await db.wfh_requests.create_index([("employee_username", 1), ("status", 1), ("approved_at", -1)])
+        # Admin log listings and analysis (newest first), overall and per employee
+        await db.access_logs.create_index([("timestamp", -1)])
+        await db.access_logs.create_index([("employee_username", 1), ("timestamp", -1)])
+        # Top-K anomalies by insert-time score (only flagged logs are indexed)
+        await db.access_logs.create_index(
+            [("is_anomaly", 1), ("anomaly_score", 1)],
+            partialFilterExpression={"is_anomaly": True}
+        )
+        # File listing filtered by uploader, and point lookups by file id
+        await db.file_metadata.create_index([("uploaded_by", 1)])
+        await db.file_metadata.create_index([("file_id", 1)])
+    except Exception as e:
+        logger.error(f"Error creating indexes: {e}")
+    try:
+        # At most one pending WFH request per employee, enforced atomically on insert.
+        # Created separately: it fails (and is retried next startup) while duplicate pending requests exist.
+        await db.wfh_requests.create_index(
+            [("employee_username", 1)],
+            name="one_pending_wfh_request",
+            unique=True,
+            partialFilterExpression={"status": "pending"}
+        )
+    except Exception as e:
+        logger.error(f"Error creating unique pending WFH request index: {e}")
+
+async def init_access_log_storage():
+    """Create or convert access_logs as a capped collection when ACCESS_LOGS_CAP_MB is set"""
+    if ACCESS_LOGS_CAP_MB <= 0:
+        return
+    size = ACCESS_LOGS_CAP_MB * 1024 * 1024
+    try:
+        if "access_logs" not in await db.list_collection_names(filter={"name": "access_logs"}):
+            await db.create_collection("access_logs", capped=True, size=size)
+            logger.info(f"Created capped access_logs collection ({ACCESS_LOGS_CAP_MB} MiB)")
+            return
+        options = await db.access_logs.options()
+        if not options.get("capped"):
+            # Keeps the newest documents that fit; older audit entries are discarded
+            await db.command("convertToCapped", "access_logs", size=size)
+            logger.info(f"Converted access_logs to a capped collection ({ACCESS_LOGS_CAP_MB} MiB)")
+    except Exception as e:
+        logger.error(f"Error configuring capped access_logs: {e}")
+
+async def migrate_wfh_windows():
+    """Convert WFH access windows stored as ISO strings by older versions into BSON dates"""
+    try:
+        for field in ("access_start", "access_end"):
+            result = await db.wfh_requests.update_many(
+                {field: {"$type": "string"}},
+                [{"$set": {field: {"$convert": {"input": f"${field}", "to": "date", "onError": f"${field}"}}}}]
+            )
+            if result.modified_count:
+                logger.info(f"Converted {result.modified_count} WFH {field} values to dates")
+    except Exception as e:
+        logger.error(f"Error migrating WFH access windows: {e}")
+
 # Lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global client, db, fs, file_service, file_permission_validator
+    global client, db, fs, file_service, file_permission_validator, cpu_pool, anomaly_refit_task, geofence_config_watcher
     logger.info("Starting up application...")
-    client = AsyncIOMotorClient(mongo_url)
+    cpu_pool = ThreadPoolExecutor(max_workers=CPU_POOL_WORKERS, thread_name_prefix="cpu")
+    # tz_aware: BSON dates (WFH access windows) come back as UTC-aware datetimes
+    client = AsyncMongoClient(mongo_url, tz_aware=True)
     db = client[os.environ['DB_NAME']]
-    fs = motor.motor_asyncio.AsyncIOMotorGridFSBucket(db)
+    fs = AsyncGridFSBucket(db)
     
     # Initialize file service
-    file_service = FileService(fs, db, crypto_service)
+    file_service = FileService(fs, db, crypto_service, log_writer=enqueue_audit_log)
     file_permission_validator = FilePermissionValidator(db)
     
+    await init_redis()
+    await start_audit_workers()
     await init_admin()
+    await init_access_log_storage()
+    await init_indexes()
+    await migrate_wfh_windows()
+    anomaly_refit_task = asyncio.create_task(_anomaly_refit_loop())
+    geofence_config_watcher = asyncio.create_task(_watch_geofence_config())
     logger.info("Application startup complete")
     
     yield
     
     # Shutdown
     logger.info("Shutting down application...")
+    anomaly_refit_task.cancel()
+    geofence_config_watcher.cancel()
+    await stop_audit_workers()
     if client:
-        client.close()
+        await client.close()
+    if redis_client:
+        await redis_client.aclose()
+    cpu_pool.shutdown(wait=False, cancel_futures=True)
     logger.info("Application shutdown complete")
 
 # Create the main app with lifespan
-app = FastAPI(title="GeoCrypt API", lifespan=lifespan)
+app = FastAPI(title="GeoCrypt API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Create API router
 api_router = APIRouter(prefix="/api")
@@ -226,7 +479,7 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     token = authorization.replace("Bearer ", "")
     
     # Check if token is blacklisted (logged out)
-    if is_token_blacklisted(token):
+    if await is_token_blacklisted(token):
         raise HTTPException(status_code=401, detail="Token has been revoked. Please login again.")
     
     payload = verify_token(token)
@@ -240,19 +493,130 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     
     return user
 
+_ROLE_DENIED_DETAIL = {
+    UserRole.ADMIN: "Admin access required",
+    UserRole.EMPLOYEE: "Employee access only",
+}
+
+def require_role(role: UserRole):
+    """Dependency factory: resolve the current user and enforce their role"""
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        if current_user["role"] != role:
+            raise HTTPException(status_code=403, detail=_ROLE_DENIED_DETAIL.get(role, "Forbidden"))
+        return current_user
+    return dependency
+
+# Shared instances so FastAPI caches each resolved dependency once per request
+require_admin = require_role(UserRole.ADMIN)
+require_employee = require_role(UserRole.EMPLOYEE)
+
+
+async def run_cpu_bound(func, *args):
+    """Run a synchronous CPU-bound call on the shared thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, func, *args)
+
+async def get_geofence_config_cached() -> Optional[dict]:
+    """Current geofence config, served from the in-process cache while fresh (treat as read-only)"""
+    if geofence_config_cache.fresh():
+        return geofence_config_cache.value
+    version = geofence_config_cache.version
+    config = await db.geofence_config.find_one({}, {"_id": 0})
+    geofence_config_cache.store(config, version)
+    return config
+
+async def _watch_geofence_config():
+    """Invalidate the cached geofence config whenever any worker changes it"""
+    try:
+        async with await db.geofence_config.watch() as stream:
+            async for _ in stream:
+                geofence_config_cache.invalidate()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.info(f"Geofence config change stream unavailable ({e}) - relying on cache TTL")
+
+async def _latest_wfh_window(username: str) -> Optional[dict]:
+    """
+    Latest approved WFH request for username as {_id, within_window}.
+    The window check runs in MongoDB against $$NOW, so nothing is parsed or compared here.
+    """
+    cursor = await db.wfh_requests.aggregate([
+        {"$match": {"employee_username": username, "status": "approved"}},
+        {"$sort": {"approved_at": -1}},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 1,
+            "within_window": {"$and": [
+                {"$eq": [{"$type": "$access_start"}, "date"]},
+                {"$eq": [{"$type": "$access_end"}, "date"]},
+                {"$lte": ["$access_start", "$$NOW"]},
+                {"$gte": ["$access_end", "$$NOW"]}
+            ]}
+        }}
+    ])
+    docs = await cursor.to_list(1)
+    return docs[0] if docs else None
+
+class AccessContext(NamedTuple):
+    """Inputs to an employee file-access decision"""
+    wfh_request: Optional[dict]  # latest approved WFH request as {_id, within_window}
+    config: Optional[dict]  # geofence config (shared, read-only)
+
+async def resolve_access_context(username: str) -> AccessContext:
+    """Fetch the WFH window and geofence config concurrently"""
+    wfh_request, config = await asyncio.gather(
+        _latest_wfh_window(username),
+        get_geofence_config_cached()
+    )
+    return AccessContext(wfh_request, config)
+
+async def _access_log_fingerprint(query: dict) -> tuple:
+    """
+    Cheap training-set fingerprint: timestamp and _id of the newest matching log.
+    Access logs are append-only, so any insert changes it; one indexed find_one
+    instead of a count over the (unbounded) collection.
+    """
+    newest = await db.access_logs.find_one(query, {"_id": 1, "timestamp": 1}, sort=[("timestamp", -1)])
+    return (newest.get("timestamp"), newest["_id"]) if newest else None
+
 
-def _parse_iso_to_utc(s: Optional[str]) -> Optional[datetime]:
+def _stream_json_array(cursor) -> StreamingResponse:
     """
-    Parse an ISO 8601 string to a timezone-aware UTC datetime.
+    Stream a MongoDB cursor to the client as a JSON array, encoding one document at a time.
+    Keeps memory per connection bounded by the cursor batch instead of the full result list.
+    """
+    async def generate():
+        yield b"["
+        first = True
+        async for doc in cursor:
+            if first:
+                first = False
+                yield orjson.dumps(doc)
+            else:
+                yield b"," + orjson.dumps(doc)
+        yield b"]"
+
+    return StreamingResponse(generate(), media_type="application/json")
+
+
+def _parse_iso_to_utc(s) -> Optional[datetime]:
+    """
+    Parse an ISO 8601 string (or pass through a BSON date) to a timezone-aware UTC datetime.
     Accepts values with 'Z' or explicit offsets or naive datetimes and returns UTC aware.
     Returns None on parse failure or if s is None.
     """
-    if not s:
+    if isinstance(s, datetime):
+        return s.replace(tzinfo=timezone.utc) if s.tzinfo is None else s.astimezone(timezone.utc)
+    if not s or not isinstance(s, str):
         return None
+    return _parse_iso_str_to_utc(s)
+
+@lru_cache(maxsize=4096)
+def _parse_iso_str_to_utc(s: str) -> Optional[datetime]:
+    # Cached: the same stored WFH window strings are re-parsed on every list/access request
     try:
         # Replace Z with +00:00 so fromisoformat can parse it
-        normalized = s.replace('Z', '+00:00') if isinstance(s, str) else s
-        dt = datetime.fromisoformat(normalized)
+        dt = datetime.fromisoformat(s.replace('Z', '+00:00'))
     except Exception:
         return None
     # Make the datetime timezone-aware and converted to UTC
@@ -263,35 +627,47 @@ def _parse_iso_to_utc(s: Optional[str]) -> Optional[datetime]:
     return dt
 
 # Auth Routes
+async def _audit_username(username: str, raw_username: str) -> str:
+    """Stored username for failed-auth audit logs; the raw input only when no such user exists"""
+    user = await db.users.find_one({"username": username}, {"_id": 0, "username": 1}, collation=USERNAME_COLLATION)
+    return user["username"] if user else raw_username
+
 @api_router.post("/auth/login")
 async def login(request: LoginRequest, background_tasks: BackgroundTasks):
-    # Rate limiting check
-    if not check_rate_limit(request.username):
-        logger.warning(f"Rate limit exceeded for user: {request.username}")
+    # Single clock read shared by the audit log, OTP expiry and otp_sent_at
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    now_ts = int(now.timestamp())
+    
+    # Reject malformed usernames before any rate-limit, DB or crypto work,
+    # so the rate-limit map only ever holds well-formed identifiers
+    if not validate_username(request.username):
+        raise HTTPException(status_code=400, detail="Invalid username format")
+    username = request.username.casefold()
+    
+    # Rate limiting check (keyed on the normalized username)
+    if not check_rate_limit(username):
+        logger.warning(f"Rate limit exceeded for user: {username}")
         # Log failed login due to rate limit
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
+        enqueue_audit_log({
+            "employee_username": await _audit_username(username, request.username),
             "action": "login_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso,
             "success": False,
             "reason": "Rate limit exceeded",
             "log_type": "authentication"
         })
         raise HTTPException(status_code=429, detail="Too many login attempts. Please try again later.")
     
-    # Input validation
-    if not validate_username(request.username):
-        raise HTTPException(status_code=400, detail="Invalid username format")
-    
-    user = await db.users.find_one({"username": request.username}, {"_id": 0})
+    user = await db.users.find_one({"username": username}, {"_id": 0}, collation=USERNAME_COLLATION)
     
     if not user or not verify_password(request.password, user["password_hash"]):
         # Log failed login attempt
-        logger.warning(f"Failed login attempt for user: {request.username}")
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
+        logger.warning(f"Failed login attempt for user: {username}")
+        enqueue_audit_log({
+            "employee_username": user["username"] if user else request.username,
             "action": "login_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso,
             "success": False,
             "reason": "Invalid credentials",
             "log_type": "authentication"
@@ -301,10 +677,10 @@ async def login(request: LoginRequest, background_tasks: BackgroundTasks):
     
     if not user.get("is_active", True):
         # Log failed login for disabled account
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
+        enqueue_audit_log({
+            "employee_username": user["username"],
             "action": "login_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso,
             "success": False,
             "reason": "Account is disabled",
             "log_type": "authentication"
@@ -313,12 +689,12 @@ async def login(request: LoginRequest, background_tasks: BackgroundTasks):
     
     # Generate OTP
     otp = generate_otp()
-    otp_expiry = datetime.now(timezone.utc) + timedelta(minutes=5)
+    otp_expiry = now_ts + OTP_EXPIRY_SECONDS  # Epoch seconds so expiry can be checked inside the query
     hashed_otp = hash_otp(otp)  # Hash OTP before storing
     
     await db.users.update_one(
-        {"username": request.username},
-        {"$set": {"otp": hashed_otp, "otp_expiry": otp_expiry.isoformat(), "otp_sent_at": datetime.now(timezone.utc).isoformat()}}
+        {"username": user["username"]},
+        {"$set": {"otp": hashed_otp, "otp_expiry": otp_expiry, "otp_sent_at": now_iso}}
     )
     
     # Send OTP via email in background (non-blocking)
@@ -334,7 +710,16 @@ async def login(request: LoginRequest, background_tasks: BackgroundTasks):
 
 @api_router.post("/auth/resend-otp")
 async def resend_otp(request: ResendOTPRequest, background_tasks: BackgroundTasks):
-    user = await db.users.find_one({"username": request.username}, {"_id": 0})
+    if not validate_username(request.username):
+        raise HTTPException(status_code=400, detail="Invalid username format")
+    username = request.username.casefold()
+    
+    # OTP resends and verifications share a per-username budget, separate from login
+    if not check_rate_limit(f"otp:{username}"):
+        logger.warning(f"Rate limit exceeded for OTP resend: {username}")
+        raise HTTPException(status_code=429, detail="Too many attempts. Please try again later.")
+    
+    user = await db.users.find_one({"username": username}, {"_id": 0}, collation=USERNAME_COLLATION)
     if not user:
         raise HTTPException(status_code=401, detail="Authentication failed")  # Generic error
 
@@ -352,11 +737,11 @@ async def resend_otp(request: ResendOTPRequest, background_tasks: BackgroundTask
 
     # Generate new OTP & send
     otp = generate_otp()
-    otp_expiry = datetime.now(timezone.utc) + timedelta(minutes=5)
+    otp_expiry = int(now.timestamp()) + OTP_EXPIRY_SECONDS
     hashed_otp = hash_otp(otp)  # Hash OTP before storing
     await db.users.update_one(
-        {"username": request.username},
-        {"$set": {"otp": hashed_otp, "otp_expiry": otp_expiry.isoformat(), "otp_sent_at": datetime.now(timezone.utc).isoformat()}}
+        {"username": user["username"]},
+        {"$set": {"otp": hashed_otp, "otp_expiry": otp_expiry, "otp_sent_at": now.isoformat()}}
     )
 
     # Send OTP via email in background (non-blocking)
@@ -366,56 +751,53 @@ async def resend_otp(request: ResendOTPRequest, background_tasks: BackgroundTask
 
 @api_router.post("/auth/verify-otp")
 async def verify_otp_endpoint(request: OTPVerifyRequest, response: Response):
-    user = await db.users.find_one({"username": request.username}, {"_id": 0})
+    if not validate_username(request.username):
+        raise HTTPException(status_code=400, detail="Invalid username format")
+    username = request.username.casefold()
     
-    if not user:
-        raise HTTPException(status_code=401, detail="Authentication failed")  # Generic error to prevent user enumeration
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
     
-    if not user.get("otp"):
-        # Log failed OTP verification - no OTP generated
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
+    # Throttle OTP guessing (same normalized-username budget as resend-otp)
+    if not check_rate_limit(f"otp:{username}"):
+        logger.warning(f"Rate limit exceeded for OTP verification: {username}")
+        enqueue_audit_log({
+            "employee_username": await _audit_username(username, request.username),
             "action": "otp_verify_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso,
             "success": False,
-            "reason": "No OTP generated",
-            "log_type": "authentication"
-        })
-        raise HTTPException(status_code=401, detail="No OTP generated. Please login again.")
-    
-    # Hash the provided OTP and compare with stored hashed OTP
-    hashed_provided_otp = hash_otp(request.otp)
-    if hashed_provided_otp != user["otp"]:
-        # Log failed OTP verification - invalid OTP
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
-            "action": "otp_verify_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "success": False,
-            "reason": "Invalid OTP",
+            "reason": "Rate limit exceeded",
             "log_type": "authentication"
         })
-        raise HTTPException(status_code=401, detail="Invalid OTP")
-    
-    # Check OTP expiry
-    otp_expiry = datetime.fromisoformat(user["otp_expiry"])
-    if datetime.now(timezone.utc) > otp_expiry:
-        # Log failed OTP verification - expired OTP
-        await db.access_logs.insert_one({
-            "employee_username": request.username,
+        raise HTTPException(status_code=429, detail="Too many attempts. Please try again later.")
+    
+    # Match and consume the OTP in a single atomic operation: the filter only matches
+    # when the hashed OTP is correct and not yet expired, so two concurrent requests
+    # cannot both succeed with the same code.
+    user = await db.users.find_one_and_update(
+        {
+            "username": username,
+            "otp": hash_otp(request.otp),
+            "otp_expiry": {"$gt": int(now.timestamp())}
+        },
+        {"$set": {"otp": None, "otp_expiry": None}},
+        projection={"_id": 0, "role": 1, "username": 1, "email": 1},
+        return_document=ReturnDocument.AFTER,
+        collation=USERNAME_COLLATION
+    )
+    
+    if not user:
+        # Log failed OTP verification (unknown user, no OTP, wrong OTP or expired OTP)
+        enqueue_audit_log({
+            "employee_username": await _audit_username(username, request.username),
             "action": "otp_verify_failed",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": now_iso,
             "success": False,
-            "reason": "OTP expired",
+            "reason": "Invalid or expired OTP",
             "log_type": "authentication"
         })
-        raise HTTPException(status_code=401, detail="OTP expired")
-    
-    # Clear OTP
-    await db.users.update_one(
-        {"username": request.username},
-        {"$set": {"otp": None, "otp_expiry": None}}
-    )
+        # Generic error to prevent user enumeration
+        raise HTTPException(status_code=401, detail="Invalid or expired OTP. Please login again.")
     
     # Create access token and refresh token
     access_token = create_access_token({"sub": user["username"], "role": user["role"]})
@@ -444,10 +826,10 @@ async def verify_otp_endpoint(request: OTPVerifyRequest, response: Response):
     
     # Also return tokens for immediate use (backward compatibility)
     # Log successful login
-    await db.access_logs.insert_one({
-        "employee_username": request.username,
+    enqueue_audit_log({
+        "employee_username": user["username"],
         "action": "login",
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": now_iso,
         "success": True,
         "reason": "Successful OTP verification",
         "log_type": "authentication"
@@ -465,7 +847,8 @@ async def verify_otp_endpoint(request: OTPVerifyRequest, response: Response):
 @api_router.post("/auth/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest):
     """Request password reset token - sends email with reset link"""
-    user = await db.users.find_one({"email": request.email}, {"_id": 0})
+    # Case-insensitive, like the username lookups in login/resend/verify
+    user = await db.users.find_one({"email": request.email}, {"_id": 0}, collation=USERNAME_COLLATION)
     
     if not user:
         # Don't reveal whether email exists (prevent user enumeration)
@@ -477,7 +860,7 @@ async def forgot_password(request: ForgotPasswordRequest):
     # Store reset token in database with expiration
     reset_expiry = datetime.now(timezone.utc) + timedelta(hours=1)
     await db.users.update_one(
-        {"email": request.email},
+        {"username": user["username"]},
         {"$set": {"password_reset_token": reset_token, "password_reset_expiry": reset_expiry.isoformat()}}
     )
     
@@ -504,7 +887,7 @@ async def reset_password(request: ResetPasswordRequest):
         raise HTTPException(status_code=400, detail="Invalid or expired reset link")
     
     # Find user
-    user = await db.users.find_one({"email": email}, {"_id": 0})
+    user = await db.users.find_one({"email": email}, {"_id": 0}, collation=USERNAME_COLLATION)
     
     if not user:
         raise HTTPException(status_code=400, detail="Invalid or expired reset link")
@@ -529,7 +912,7 @@ async def reset_password(request: ResetPasswordRequest):
     # Update password
     new_password_hash = hash_password(request.new_password)
     await db.users.update_one(
-        {"email": email},
+        {"username": user["username"]},
         {
             "$set": {
                 "password_hash": new_password_hash,
@@ -578,7 +961,7 @@ async def logout(authorization: Optional[str] = Header(None), current_user: dict
     token = authorization.replace("Bearer ", "")
     
     # Blacklist the token
-    blacklist_token(token)
+    await blacklist_token(token)
     
     logger.info(f"User {current_user['username']} logged out")
     
@@ -670,7 +1053,7 @@ async def validate_access_route(latitude: Optional[float] = None, longitude: Opt
     Debug endpoint - validate a hypothetical access request using current geofence configuration.
     Returns the validation_result returned by GeofenceValidator.
     """
-    config = await db.geofence_config.find_one({}, {"_id": 0})
+    config = await get_geofence_config_cached()
     # Use minimal request object
     req = {"latitude": latitude, "longitude": longitude, "wifi_ssid": wifi_ssid}
     result = geofence_validator.validate_access(req, config, False)
@@ -687,10 +1070,7 @@ async def get_server_time():
 
 # Admin Routes
 @api_router.post("/admin/employees")
-async def create_employee(employee: UserCreate, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def create_employee(employee: UserCreate, current_user: dict = Depends(require_admin)):
     # Input validation
     if not validate_username(employee.username):
         raise HTTPException(status_code=400, detail="Invalid username format (3-20 chars, alphanumeric and underscore only)")
@@ -701,8 +1081,8 @@ async def create_employee(employee: UserCreate, current_user: dict = Depends(get
     if len(employee.password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters long")
     
-    # Check if user exists
-    existing = await db.users.find_one({"username": employee.username})
+    # Check if user exists (case-insensitive, matching how the auth endpoints resolve usernames)
+    existing = await db.users.find_one({"username": employee.username}, collation=USERNAME_COLLATION)
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists")
     
@@ -725,22 +1105,16 @@ async def create_employee(employee: UserCreate, current_user: dict = Depends(get
     return {"message": "Employee created successfully", "username": employee.username}
 
 @api_router.get("/admin/employees")
-async def get_employees(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    employees = await db.users.find(
+async def get_employees(current_user: dict = Depends(require_admin)):
+    cursor = db.users.find(
         {"role": UserRole.EMPLOYEE},
         {"_id": 0, "password_hash": 0, "otp": 0, "otp_expiry": 0}
-    ).to_list(1000)
+    ).batch_size(200).limit(1000)
     
-    return employees
+    return _stream_json_array(cursor)
 
 @api_router.put("/admin/employees/{username}")
-async def update_employee(username: str, updates: dict, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def update_employee(username: str, updates: dict, current_user: dict = Depends(require_admin)):
     # Don't allow password to be updated directly
     if "password" in updates:
         updates["password_hash"] = hash_password(updates.pop("password"))
@@ -756,10 +1130,7 @@ async def update_employee(username: str, updates: dict, current_user: dict = Dep
     return {"message": "Employee updated successfully"}
 
 @api_router.delete("/admin/employees/{username}")
-async def delete_employee(username: str, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def delete_employee(username: str, current_user: dict = Depends(require_admin)):
     result = await db.users.delete_one({"username": username, "role": UserRole.EMPLOYEE})
     
     if result.deleted_count == 0:
@@ -768,26 +1139,23 @@ async def delete_employee(username: str, current_user: dict = Depends(get_curren
     return {"message": "Employee deleted successfully"}
 
 @api_router.get("/admin/access-logs")
-async def get_access_logs(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_access_logs(current_user: dict = Depends(require_admin)):
     # Get both file access logs and authentication logs, sorted by timestamp (newest first)
-    logs = await db.access_logs.find({}, {"_id": 0}).sort("timestamp", -1).to_list(1000)
-    return logs
+    cursor = db.access_logs.find({}, {"_id": 0}).sort("timestamp", -1).batch_size(200).limit(1000)
+    return _stream_json_array(cursor)
 
 @api_router.get("/admin/suspicious-activities")
-async def analyze_suspicious_activities(current_user: dict = Depends(get_current_user)):
+async def analyze_suspicious_activities(current_user: dict = Depends(require_admin)):
     """
     AI-powered analysis of suspicious activities using ML detection
     Combines statistical anomaly detection with rule-based pattern matching
     """
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     try:
-        # Get all access logs (last 2000 for performance)
-        logs = await db.access_logs.find({}, {"_id": 0}).sort("timestamp", -1).to_list(2000)
+        # Fingerprint first: a log inserted after this point only makes the cache entry stale sooner
+        fingerprint = await _access_log_fingerprint({})
+        
+        # Get all access logs (last 2000 for performance), fetched in a single batch
+        logs = await db.access_logs.find({}, ANALYSIS_LOG_PROJECTION).sort("timestamp", -1).batch_size(2000).to_list(2000)
         
         if not logs:
             return {
@@ -802,62 +1170,69 @@ async def analyze_suspicious_activities(current_user: dict = Depends(get_current
                 "analysis_timestamp": datetime.now(timezone.utc).isoformat()
             }
         
-        # Train model with historical data if enough samples
+        # Train model with historical data if enough samples, reusing the cached fit while logs are unchanged
+        detector = anomaly_detector
         if len(logs) >= 50:
-            anomaly_detector.train(logs)
+            detector = model_cache.get("all", fingerprint)
+            if detector is None:
+                detector = AnomalyDetector()
+                if await run_cpu_bound(detector.train, logs):
+                    model_cache.put("all", fingerprint, detector)
+                else:
+                    # Never cache an unfitted model; use the shared detector for this request
+                    detector = anomaly_detector
         
         # Run comprehensive analysis
-        analysis_result = anomaly_detector.analyze_suspicious_activities(logs)
+        analysis_result = await run_cpu_bound(detector.analyze_suspicious_activities, logs)
         
         logger.info(f"Suspicious activity analysis completed: {analysis_result['suspicious_count']} anomalies detected")
         
-        return analysis_result
+        # Returned as a response directly: orjson encodes the large result without a jsonable_encoder pass
+        return ORJSONResponse(analysis_result)
     
     except Exception as e:
         logger.error(f"Error in suspicious activity analysis: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@api_router.get("/admin/anomalies")
+async def get_anomalies(limit: int = 50, current_user: dict = Depends(require_admin)):
+    """Most anomalous access logs as scored at insert time (lowest IsolationForest score first)"""
+    limit = max(1, min(limit, 500))
+    cursor = db.access_logs.find(
+        {"is_anomaly": True},
+        {**ANALYSIS_LOG_PROJECTION, "anomaly_score": 1, "reason": 1, "filename": 1}
+    ).sort("anomaly_score", 1).limit(limit)
+    return _stream_json_array(cursor)
+
 @api_router.get("/admin/check-ins")
-async def get_check_ins(current_user: dict = Depends(get_current_user)):
+async def get_check_ins(current_user: dict = Depends(require_admin)):
     """Get all employee check-in logs (login events)"""
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     # Get all login-related logs
     check_ins = await db.access_logs.find(
         {"action": {"$in": ["login", "login_failed"]}}, 
         {"_id": 0}
     ).sort("timestamp", -1).to_list(1000)
     
-    return check_ins
+    return ORJSONResponse(check_ins)
 
 @api_router.get("/admin/file-access")
-async def get_file_access(current_user: dict = Depends(get_current_user)):
+async def get_file_access(current_user: dict = Depends(require_admin)):
     """Get all file access logs"""
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
     # Get all file access and download logs
     file_access = await db.access_logs.find(
         {"action": {"$in": ["access", "download", "denied"]}}, 
         {"_id": 0}
     ).sort("timestamp", -1).to_list(1000)
     
-    return file_access
+    return ORJSONResponse(file_access)
 
 @api_router.get("/admin/wfh-requests")
-async def get_wfh_requests(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    requests = await db.wfh_requests.find({}, {"_id": 0}).sort("requested_at", -1).to_list(1000)
-    return requests
+async def get_wfh_requests(current_user: dict = Depends(require_admin)):
+    requests = await db.wfh_requests.find({}, {"_id": 0}).sort("requested_at", -1).batch_size(1000).to_list(1000)
+    return ORJSONResponse(requests)
 
 @api_router.put("/admin/wfh-requests/{employee_username}")
-async def update_wfh_request(employee_username: str, action: dict, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def update_wfh_request(employee_username: str, action: dict, current_user: dict = Depends(require_admin)):
     status = action.get("status")  # approved or rejected
     comment = action.get("comment", "")
     access_start = action.get("access_start")
@@ -870,14 +1245,14 @@ async def update_wfh_request(employee_username: str, action: dict, current_user:
         "approved_at": datetime.now(timezone.utc).isoformat()
     }
 
-    # If admin provided access window, validate and store as ISO strings
+    # If admin provided access window, validate and store as BSON dates
     if access_start:
         try:
-            # Parse to timezone-aware UTC and persist as ISO strings with tz info
+            # Parse to timezone-aware UTC and persist as a native date
             start_dt = _parse_iso_to_utc(access_start)
             if not start_dt:
                 raise ValueError("Invalid access_start format")
-            update_doc["access_start"] = start_dt.isoformat()
+            update_doc["access_start"] = start_dt
         except (ValueError, AttributeError):
             raise HTTPException(status_code=400, detail=f"Invalid access_start format: {access_start}. Use ISO 8601 format (e.g., 2025-12-07T09:00:00 or 2025-12-07T09:00:00+00:00)")
     
@@ -886,7 +1261,7 @@ async def update_wfh_request(employee_username: str, action: dict, current_user:
             end_dt = _parse_iso_to_utc(access_end)
             if not end_dt:
                 raise ValueError("Invalid access_end format")
-            update_doc["access_end"] = end_dt.isoformat()
+            update_doc["access_end"] = end_dt
         except (ValueError, AttributeError):
             raise HTTPException(status_code=400, detail=f"Invalid access_end format: {access_end}. Use ISO 8601 format (e.g., 2025-12-07T17:00:00 or 2025-12-07T17:00:00+00:00)")
     
@@ -910,53 +1285,55 @@ async def update_wfh_request(employee_username: str, action: dict, current_user:
     return {"message": f"Request {status}"}
 
 @api_router.get("/admin/geofence-config")
-async def get_geofence_config(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_geofence_config(current_user: dict = Depends(require_admin)):
     config = await db.geofence_config.find_one({}, {"_id": 0})
     return config
 
 @api_router.put("/admin/geofence-config")
-async def update_geofence_config(config: GeofenceConfig, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def update_geofence_config(config: GeofenceConfig, current_user: dict = Depends(require_admin)):
     await db.geofence_config.update_one({}, {"$set": config.model_dump()}, upsert=True)
+    geofence_config_cache.invalidate()
     
     return {"message": "Configuration updated successfully"}
 
 @api_router.get("/admin/analytics/{employee_username}")
-async def get_employee_analytics(employee_username: str, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
+async def get_employee_analytics(employee_username: str, current_user: dict = Depends(require_admin)):
+    query = {"employee_username": employee_username}
+    fingerprint = await _access_log_fingerprint(query)
     
     # Get employee activities
     activities = await db.access_logs.find(
-        {"employee_username": employee_username},
-        {"_id": 0}
-    ).to_list(1000)
+        query,
+        ANALYSIS_LOG_PROJECTION
+    ).batch_size(1000).to_list(1000)
     
-    # Train and analyze
+    # Train (or reuse this employee's cached model) and analyze
+    detector = anomaly_detector
     if len(activities) >= 10:
-        anomaly_detector.train(activities)
+        scope = ("employee", employee_username)
+        detector = model_cache.get(scope, fingerprint)
+        if detector is None:
+            detector = AnomalyDetector()
+            if await run_cpu_bound(detector.train, activities):
+                model_cache.put(scope, fingerprint, detector)
+            else:
+                # Never cache an unfitted model; use the shared detector for this request
+                detector = anomaly_detector
     
-    analysis = anomaly_detector.analyze_employee_behavior(activities)
+    analysis = await run_cpu_bound(detector.analyze_employee_behavior, activities)
     
     return analysis
 
 # File Routes
 @api_router.post("/files/upload")
-async def upload_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def upload_file(file: UploadFile = File(...), current_user: dict = Depends(require_admin)):
     try:
-        file_content = await file.read()
+        # Streamed: read, encrypted and stored in chunks rather than buffered whole
         result = await file_service.upload_file(
-            file_content=file_content,
+            file_content=None,
             filename=file.filename,
-            uploaded_by=current_user["username"]
+            uploaded_by=current_user["username"],
+            file_object=file
         )
         return result
     except Exception as e:
@@ -972,11 +1349,29 @@ async def list_files(latitude: Optional[float] = None, longitude: Optional[float
     uploaded_by = "admin" if current_user["role"] == UserRole.EMPLOYEE else None
     files_cursor = await file_service.list_files(uploaded_by=uploaded_by)
 
-    # Evaluate accessibility for each file for this employee if coordinates/wifi are provided
-    config = await db.geofence_config.find_one({}, {"_id": 0})
     result_files = []
     logger.info(f"Listing files called by user={current_user['username']} with lat={latitude}, lon={longitude}, wifi={wifi_ssid}")
-    logger.info(f"Geofence config: {config}")
+
+    # Resolve the caller's WFH override and the geofence config once for the whole listing
+    # (neither depends on the file); the latest approved WFH request wins over stale ones
+    wfh_request = None
+    wfh_window_open = False
+    if current_user["role"] == UserRole.EMPLOYEE:
+        wfh_request, config = await resolve_access_context(current_user["username"])
+        logger.info(f"Geofence config: {config}")
+        wfh_window_open = bool(wfh_request and wfh_request["within_window"])
+
+    # The geofence decision depends only on the caller's position/WiFi and the config, so evaluate it once
+    validation_result = None
+    if (current_user["role"] == UserRole.EMPLOYEE and not wfh_window_open
+            and latitude is not None and longitude is not None and wifi_ssid is not None):
+        validation_result = geofence_validator.validate_access(
+            {"latitude": latitude, "longitude": longitude, "wifi_ssid": wifi_ssid},
+            config,
+            False
+        )
+        logger.info(f"Geofence validation for file listing: {validation_result}")
+
     for f in files_cursor:
         file_obj = f.copy()
         file_obj["accessible"] = False
@@ -990,46 +1385,29 @@ async def list_files(latitude: Optional[float] = None, longitude: Optional[float
             continue
 
         # Check WFH override first
-        # Prefer the latest approved WFH request (sorted by approved_at desc) to avoid using stale requests
-        wfh_request = await db.wfh_requests.find_one(
-            {"employee_username": current_user["username"], "status": "approved"},
-            sort=[("approved_at", -1)]
-        )
-        now = datetime.now(timezone.utc)
-        if wfh_request:
-            access_start = _parse_iso_to_utc(wfh_request.get("access_start"))
-            access_end = _parse_iso_to_utc(wfh_request.get("access_end"))
-            if access_start and access_end:
-                # We expect access_start/access_end to already be timezone-aware UTC datetimes
-                if access_start <= now <= access_end:
-                    file_obj["accessible"] = True
-                    file_obj["access_reason"] = "WFH approved - within access window"
-                    # Include the WFH request id for audit/debugging
-                    file_obj["wfh_request_id"] = str(wfh_request.get("_id"))
-                    result_files.append(file_obj)
-                    continue
+        if wfh_window_open:
+            file_obj["accessible"] = True
+            file_obj["access_reason"] = "WFH approved - within access window"
+            # Include the WFH request id for audit/debugging
+            file_obj["wfh_request_id"] = str(wfh_request.get("_id"))
+            result_files.append(file_obj)
+            continue
 
         # If coords/wifi not provided, we cannot determine access - keep accessible False
-        if latitude is None or longitude is None or wifi_ssid is None:
+        if validation_result is None:
             file_obj["accessible"] = False
             file_obj["access_reason"] = "Location/WiFi not provided"
             result_files.append(file_obj)
             continue
 
-        # Otherwise validate geofence
-        validation_result = geofence_validator.validate_access(
-            {"latitude": latitude, "longitude": longitude, "wifi_ssid": wifi_ssid},
-            config,
-            False
-        )
-        logger.info(f"Per-file validation for {file_obj['file_id']}: {validation_result}")
+        # Otherwise apply the geofence decision
         file_obj["accessible"] = validation_result.get("allowed", False)
         file_obj["access_reason"] = validation_result.get("reason", "Access denied")
         file_obj["validations"] = validation_result.get("validations")
 
         result_files.append(file_obj)
 
-    return result_files
+    return ORJSONResponse(result_files)
 
 @api_router.post("/files/access")
 async def access_file(request: AccessRequest, current_user: dict = Depends(get_current_user)):
@@ -1039,58 +1417,23 @@ async def access_file(request: AccessRequest, current_user: dict = Depends(get_c
         if current_user["role"] != UserRole.EMPLOYEE:
             # Admin has unrestricted access
             try:
-                file_data = await file_service.access_file(request.file_id)
-                
-                return StreamingResponse(
-                    io.BytesIO(file_data["content"]),
-                    media_type=file_data["media_type"],
-                    headers={"Content-Disposition": f"inline; filename={file_data['filename']}"}
-                )
+                return await _stream_file_response(request.file_id)
             except ValueError as e:
                 raise HTTPException(status_code=404, detail=str(e))
         
         # Employee access - check conditions
-        # Check if WFH approved and whether access window allows bypass
-        wfh_request = await db.wfh_requests.find_one(
-            {"employee_username": current_user["username"], "status": "approved"},
-            sort=[("approved_at", -1)]
-        )
-
-        # Get geofence config
-        config = await db.geofence_config.find_one({}, {"_id": 0})
+        # WFH approval (window evaluated server-side) and geofence config, fetched concurrently
+        wfh_request, config = await resolve_access_context(current_user["username"])
         logger.info(f"Geofence config: {config}")
 
-        now = datetime.now(timezone.utc)
-        # Default validation result - not allowed until checks run
-        validation_result = {"allowed": False, "reason": "Access denied"}
         wfh_id = None
-
-        if wfh_request:
-            # If admin approved, require an allocated access window
-            access_start = _parse_iso_to_utc(wfh_request.get("access_start"))
-            access_end = _parse_iso_to_utc(wfh_request.get("access_end"))
-
-            if access_start and access_end:
-                if access_start <= now <= access_end:
-                    # WFH approved and within admin-allocated window: bypass wifi/location checks
-                    validation_result = {"allowed": True, "reason": "WFH approved - time window active"}
-                    wfh_id = str(wfh_request.get("_id"))
-                else:
-                    # WFH exists but not active. Fall back to normal geofence validation rather than blocking.
-                    validation_result = geofence_validator.validate_access(
-                        request.model_dump(),
-                        config,
-                        False
-                    )
-            else:
-                # Admin approved WFH but no window allocated, fall back to normal validation
-                validation_result = geofence_validator.validate_access(
-                    request.model_dump(),
-                    config,
-                    False
-                )
+        if wfh_request and wfh_request["within_window"]:
+            # WFH approved and within admin-allocated window: bypass wifi/location checks
+            validation_result = {"allowed": True, "reason": "WFH approved - time window active"}
+            wfh_id = str(wfh_request["_id"])
         else:
-            # No WFH approval - validate normally (must satisfy wifi, location, and time bounds)
+            # No WFH approval, no window allocated, or window not active:
+            # validate normally (must satisfy wifi, location, and time bounds)
             validation_result = geofence_validator.validate_access(
                 request.model_dump(),
                 config,
@@ -1121,13 +1464,7 @@ async def access_file(request: AccessRequest, current_user: dict = Depends(get_c
         
         # Access granted - get file
         try:
-            file_data = await file_service.access_file(request.file_id)
-            
-            return StreamingResponse(
-                io.BytesIO(file_data["content"]),
-                media_type=file_data["media_type"],
-                headers={"Content-Disposition": f"inline; filename={file_data['filename']}"}
-            )
+            return await _stream_file_response(request.file_id)
         except ValueError as e:
             raise HTTPException(status_code=404, detail=str(e))
             
@@ -1138,21 +1475,21 @@ async def access_file(request: AccessRequest, current_user: dict = Depends(get_c
         logger.error(f"Error in file access endpoint: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def _stream_file_response(file_id: str) -> StreamingResponse:
+    """Decrypt a stored file straight from GridFS into the response body"""
+    file_data = await file_service.stream_file(file_id)
+    return StreamingResponse(
+        file_data["content"],
+        media_type=file_data["media_type"],
+        headers={
+            "Content-Disposition": f"inline; filename={file_data['filename']}",
+            "Content-Length": str(file_data["size"])
+        }
+    )
+
 # WFH Request Routes
 @api_router.post("/wfh-request")
-async def create_wfh_request(request: WFHRequestCreate, current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.EMPLOYEE:
-        raise HTTPException(status_code=403, detail="Employee access only")
-    
-    # Check if pending request exists
-    existing = await db.wfh_requests.find_one({
-        "employee_username": current_user["username"],
-        "status": "pending"
-    })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="You already have a pending request")
-    
+async def create_wfh_request(request: WFHRequestCreate, current_user: dict = Depends(require_employee)):
     request_dict = {
         "employee_username": current_user["username"],
         "reason": request.reason,
@@ -1160,15 +1497,16 @@ async def create_wfh_request(request: WFHRequestCreate, current_user: dict = Dep
         "status": "pending"
     }
     
-    await db.wfh_requests.insert_one(request_dict)
+    # The partial unique index on pending requests rejects a second pending request
+    try:
+        await db.wfh_requests.insert_one(request_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="You already have a pending request")
     
     return {"message": "Work from home request submitted"}
 
 @api_router.get("/wfh-request/status")
-async def get_wfh_status(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] != UserRole.EMPLOYEE:
-        raise HTTPException(status_code=403, detail="Employee access only")
-    
+async def get_wfh_status(current_user: dict = Depends(require_employee)):
     # Get the latest (most recent) WFH request, sorted by requested_at descending
     request = await db.wfh_requests.find_one(
         {"employee_username": current_user["username"]},
@@ -1198,30 +1536,50 @@ app.add_middleware(
     allow_headers=["Content-Type", "Authorization"],  # Explicit headers only
 )
 
-# IP-based rate limiting middleware
-@app.middleware("http")
-async def ip_rate_limit_middleware(request, call_next):
-    """Apply rate limiting per IP address"""
-    client_ip = get_client_ip(request)
-    
-    # Check rate limit
-    if not check_ip_rate_limit(client_ip):
-        return HTTPException(status_code=429, detail="Too many requests from your IP. Please try again later.")
-    
-    response = await call_next(request)
-    return response
+# Request body size limit, enforced from Content-Length before the body is read
+# (Starlette would otherwise spool the whole multipart upload to a temp file first)
+MAX_REQUEST_BODY_BYTES = int(os.environ.get('MAX_REQUEST_BODY_MB', '50')) * 1024 * 1024
 
-# Security headers middleware
+def _reject_oversized_body(request) -> Optional[JSONResponse]:
+    """413 (or 400 for a malformed header) when Content-Length exceeds MAX_REQUEST_BODY_BYTES"""
+    content_length = request.headers.get("content-length")
+    if content_length:
+        try:
+            too_large = int(content_length) > MAX_REQUEST_BODY_BYTES
+        except ValueError:
+            return JSONResponse({"detail": "Invalid Content-Length header"}, status_code=400)
+        if too_large:
+            return JSONResponse({"detail": "Payload too large"}, status_code=413)
+    return None
+
+# Security headers added to every response
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+    "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+    "Content-Security-Policy": "default-src 'self'; script-src 'self'; style-src 'self' 'unsafe-inline'; img-src 'self' data: https:; font-src 'self'; connect-src 'self'; frame-ancestors 'none'; base-uri 'self'; form-action 'self'",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+    "Permissions-Policy": "geolocation=(), microphone=(), camera=()",
+}
+
+# Paths exempt from IP rate limiting (API docs)
+RATE_LIMIT_EXEMPT_PREFIXES = ("/docs", "/redoc", "/openapi")
+
+# IP rate limiting, request size limit and security headers in one middleware (one hop per request)
 @app.middleware("http")
-async def add_security_headers(request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = "default-src 'self'; script-src 'self'; style-src 'self' 'unsafe-inline'; img-src 'self' data: https:; font-src 'self'; connect-src 'self'; frame-ancestors 'none'; base-uri 'self'; form-action 'self'"
-    response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
+async def rate_limit_and_security_headers(request, call_next):
+    """Apply rate limiting per IP address, reject oversized bodies and add security headers to the response"""
+    # CORS preflights and the docs are not counted against the limit
+    exempt = request.method == "OPTIONS" or request.url.path.startswith(RATE_LIMIT_EXEMPT_PREFIXES)
+    if not exempt and not await check_ip_rate_limit(get_client_ip(request)):
+        response = JSONResponse(
+            {"detail": "Too many requests from your IP. Please try again later."},
+            status_code=429
+        )
+    else:
+        response = _reject_oversized_body(request) or await call_next(request)
+    response.headers.update(SECURITY_HEADERS)
     return response
 
 logging.basicConfig(
@@ -1231,8 +1589,18 @@ logging.basicConfig(
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    await client.close()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # "auto" picks uvloop and httptools when installed (see requirements.txt).
+    # More than one worker needs REDIS_URL: the in-memory blacklist, CSRF and
+    # rate-limit state is per process.
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.environ.get("UVICORN_WORKERS", "1"))
+    )
\ No newline at end of file
@@ -0,0 +1,123 @@
+import io
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+from crypto_service import CryptoService  # noqa: E402
+from file_service import FileService, STREAM_CHUNK_SIZE  # noqa: E402
+
+
+class FakeGridIn:
+    def __init__(self, bucket, filename):
+        self.bucket = bucket
+        self._id = ObjectId()
+        self._buffer = io.BytesIO()
+
+    async def write(self, data):
+        self._buffer.write(data)
+
+    async def close(self):
+        self.bucket.files[self._id] = self._buffer.getvalue()
+
+    async def abort(self):
+        pass
+
+
+class FakeGridOut:
+    def __init__(self, data):
+        self.length = len(data)
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self._stream.read(size)
+
+
+class FakeBucket:
+    """In-memory stand-in for AsyncGridFSBucket (only the calls FileService makes)"""
+    def __init__(self):
+        self.files = {}
+
+    def open_upload_stream(self, filename):
+        return FakeGridIn(self, filename)
+
+    async def open_download_stream(self, file_id):
+        return FakeGridOut(self.files[file_id])
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+    async def find_one(self, query, projection=None):
+        return next((dict(d) for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+
+class FakeDB:
+    def __init__(self):
+        self.file_metadata = FakeCollection()
+
+
+class FakeUpload:
+    """Async file object like UploadFile"""
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def make_service():
+    return FileService(FakeBucket(), FakeDB(), CryptoService())
+
+
+async def upload(service, data):
+    result = await service.upload_file(file_content=None, filename='test.bin', uploaded_by='admin', file_object=FakeUpload(data))
+    return result['file_id']
+
+
+async def read_streamed(service, file_id):
+    streamed = await service.stream_file(file_id)
+    return streamed, b''.join([chunk async for chunk in streamed['content']])
+
+
+SIZES = [0, 1, STREAM_CHUNK_SIZE, STREAM_CHUNK_SIZE + 1, 3 * STREAM_CHUNK_SIZE + 17]
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_streamed_upload_round_trip(size):
+    data = bytes(i % 251 for i in range(size))
+
+    async def run():
+        service = make_service()
+        file_id = await upload(service, data)
+        streamed, content = await read_streamed(service, file_id)
+        assert content == data
+        assert streamed['size'] == size
+        # The stored layout stays compatible with whole-file decryption
+        downloaded, filename = await service.download_file(file_id)
+        assert downloaded == data and filename == 'test.bin'
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('size', [1, STREAM_CHUNK_SIZE + 1, 3 * STREAM_CHUNK_SIZE + 17])
+def test_tampered_ciphertext_fails_mac_check(size):
+    async def run():
+        service = make_service()
+        file_id = await upload(service, b'x' * size)
+        grid_id = ObjectId(file_id)
+        stored = bytearray(service.fs.files[grid_id])
+        stored[-1] ^= 0x01  # flip a bit in the last ciphertext byte
+        service.fs.files[grid_id] = bytes(stored)
+
+        with pytest.raises(ValueError, match='MAC check failed'):
+            await read_streamed(service, file_id)
+
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+import sys
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+from ml_service import AnomalyDetector  # noqa: E402
+
+
+def make_activities(n, failed_every=0):
+    start = datetime(2025, 1, 6, 9, 0, tzinfo=timezone.utc)  # a Monday, office hours
+    return [
+        {
+            'timestamp': (start + timedelta(minutes=30 * i)).isoformat(),
+            'employee_username': 'aswin',
+            'success': not (failed_every and i % failed_every == 0),
+            'action': 'file_access',
+            'log_type': 'file_access',
+            'location': {'lat': 10.8505, 'lon': 76.2711},
+        }
+        for i in range(n)
+    ]
+
+
+def test_analyze_employee_behavior_with_trained_model():
+    activities = make_activities(20, failed_every=4)
+    detector = AnomalyDetector()
+    assert detector.train(activities)
+
+    analysis = detector.analyze_employee_behavior(activities)
+    assert analysis['total_activities'] == 20
+    assert analysis['failed_count'] == 5
+    assert analysis['failure_rate'] == 0.25
+    assert analysis['typical_hours'] and all(9 <= h <= 18 for h in analysis['typical_hours'])
+    assert analysis['risk_level'] in ('low', 'medium', 'high')
+    assert all(a['is_anomaly'] for a in analysis['anomalies'])
+
+
+def test_analyze_employee_behavior_untrained_and_empty():
+    detector = AnomalyDetector()
+
+    analysis = detector.analyze_employee_behavior(make_activities(3))
+    assert analysis['total_activities'] == 3
+    assert analysis['failed_count'] == 0
+    assert analysis['anomalies'] == []
+    assert analysis['risk_level'] == 'low'
+
+    empty = detector.analyze_employee_behavior([])
+    assert empty['total_activities'] == 0
+    assert empty['typical_hours'] == []
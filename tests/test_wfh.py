@@ -1,110 +1,144 @@
-import requests
-from pymongo import MongoClient
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+from pymongo import MongoClient, UpdateOne
 from datetime import datetime, timezone, timedelta
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
 BASE_URL = "http://127.0.0.1:8000/api"
 
+# Integration tests: skip the module (not the whole run) when no server is listening;
+# any HTTP status (even 404) means the server is up
+try:
+    httpx.get(f"{BASE_URL}/health", timeout=2)
+except httpx.TransportError:
+    pytest.skip(f"GeoCrypt server not reachable at {BASE_URL}", allow_module_level=True)
+
+# One client (and connection pool) for the whole module; MongoClient connects lazily
+CLIENT = MongoClient('mongodb://localhost:27017', maxPoolSize=10)
+DB = CLIENT['test_database']
+
+# Shared keep-alive httpx client for all tests (created in setup_module)
+SESSION = None
+
 
 def setup_module(module):
+    global SESSION
+    SESSION = httpx.Client(timeout=10)
+    now_iso = datetime.now(timezone.utc).isoformat()
+    # Same key specs as the server's init_indexes, so these are no-ops once it has started;
+    # the wfh_requests compound index covers the employee_username(+status) lookups below
+    DB.users.create_index([('username', 1)])
+    DB.wfh_requests.create_index([('employee_username', 1), ('status', 1), ('approved_at', -1)])
     # Ensure DB has an employee and a file for testing
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['test_database']
     # Ensure aswin exists
-    if not db.users.find_one({'username':'aswin'}):
-        db.users.insert_one({'email':'aswin@example.com','username':'aswin','password_hash':'$2b$12$dummy','role':'employee','created_at':datetime.now(timezone.utc).isoformat(),'is_active':True})
+    if not DB.users.find_one({'username':'aswin'}):
+        DB.users.insert_one({'email':'aswin@example.com','username':'aswin','password_hash':'$2b$12$dummy','role':'employee','created_at':now_iso,'is_active':True})
     # Ensure admin uploaded files exist
-    file_meta = db.file_metadata.find_one({'uploaded_by':'admin'})
+    file_meta = DB.file_metadata.find_one({'uploaded_by':'admin'})
     if not file_meta:
         # Insert a dummy file entry
-        db.file_metadata.insert_one({'file_id':'testfile123', 'filename':'test.txt', 'uploaded_by':'admin', 'uploaded_at':datetime.now(timezone.utc).isoformat(), 'encrypted':True, 'size':10, 'encryption_key':'dummykey'})
+        DB.file_metadata.insert_one({'file_id':'testfile123', 'filename':'test.txt', 'uploaded_by':'admin', 'uploaded_at':now_iso, 'encrypted':True, 'size':10, 'encryption_key':'dummykey'})
+
+
+# Bearer tokens minted once per username for the module run
+_TOKENS = {}
+
+
+async def _verify_otps(usernames):
+    """Exchange the seeded OTP for every username concurrently"""
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=10) as client:
+        return await asyncio.gather(*(client.post("/auth/verify-otp", json={'username':u, 'otp':'222222'}) for u in usernames))
+
+
+def get_tokens(*usernames):
+    """Seed a known OTP for every uncached username in one bulk_write, then exchange them at /auth/verify-otp in parallel"""
+    missing = [u for u in usernames if u not in _TOKENS]
+    if missing:
+        # Imported lazily: auth requires SECRET_KEY (the server's) at import time
+        from auth import hash_otp
+        otp_fields = {'otp': hash_otp('222222'), 'otp_expiry': int(time.time()) + 600, 'otp_sent_at':datetime.now(timezone.utc).isoformat()}
+        DB.users.bulk_write([UpdateOne({'username':u}, {'$set': otp_fields}, upsert=True) for u in missing], ordered=False)
+        for username, r in zip(missing, asyncio.run(_verify_otps(missing))):
+            assert r.status_code == 200
+            _TOKENS[username] = r.json().get('access_token')
+    return [_TOKENS[u] for u in usernames]
+
+
+def get_token(username):
+    """Return the cached access token for username, minting it on first use"""
+    return get_tokens(username)[0]
 
 
 def test_wfh_bypass_download():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['test_database']
-    # set OTP for aswin and create approved WFH
+    headers = {'Authorization': f'Bearer {get_token("aswin")}'}
+
+    # create an active WFH approved (window computed after the token so it can't go stale)
     now = datetime.now(timezone.utc)
-    db.users.update_one({'username':'aswin'}, {'$set': {'otp': '222222', 'otp_expiry': (now+timedelta(minutes=10)).isoformat(), 'otp_sent_at':now.isoformat()}}, upsert=True)
-    # create an active WFH approved
-    start = (now - timedelta(minutes=5)).isoformat()
-    end = (now + timedelta(minutes=60)).isoformat()
-    db.wfh_requests.update_one({'employee_username':'aswin'}, {'$set': {'status':'approved', 'access_start':start, 'access_end':end, 'approved_at': now.isoformat()}}, upsert=True)
-
-    # Verify OTP and get token
-    r = requests.post(f"{BASE_URL}/auth/verify-otp", json={'username':'aswin', 'otp':'222222'})
-    assert r.status_code == 200
-    token = r.json().get('access_token')
-    headers = {'Authorization': f'Bearer {token}'}
+    start = now - timedelta(minutes=5)
+    end = now + timedelta(minutes=60)
+    DB.wfh_requests.update_one({'employee_username':'aswin'}, {'$set': {'status':'approved', 'access_start':start, 'access_end':end, 'approved_at': now.isoformat()}}, upsert=True)
 
     # Call GET /files without geo/wifi - should be allowed due to WFH
-    r = requests.get(f"{BASE_URL}/files", headers=headers)
+    r = SESSION.get(f"{BASE_URL}/files", headers=headers)
     assert r.status_code == 200
     files = r.json()
     assert any(f['accessible'] and f['access_reason'].startswith('WFH approved') for f in files)
 
     # Attempt to access a file without geo/wifi
     file_id = files[0]['file_id']
-    r = requests.post(f"{BASE_URL}/files/access", headers=headers, json={'file_id': file_id})
+    r = SESSION.post(f"{BASE_URL}/files/access", headers=headers, json={'file_id': file_id})
     assert r.status_code == 200
 
 
 def test_no_wfh_blocks_access_without_location():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['test_database']
     # Ensure WFH not approved
-    db.wfh_requests.update_many({'employee_username':'aswin'},{'$set':{'status':'rejected'}})
-    # Set OTP again and verify
-    now = datetime.now(timezone.utc)
-    db.users.update_one({'username':'aswin'}, {'$set': {'otp': '333333', 'otp_expiry': (now+timedelta(minutes=10)).isoformat(), 'otp_sent_at':now.isoformat()}}, upsert=True)
-    r = requests.post(f"{BASE_URL}/auth/verify-otp", json={'username':'aswin', 'otp':'333333'})
-    assert r.status_code == 200
-    token = r.json().get('access_token')
-    headers = {'Authorization': f'Bearer {token}'}
+    DB.wfh_requests.update_many({'employee_username':'aswin'},{'$set':{'status':'rejected'}})
+    headers = {'Authorization': f'Bearer {get_token("aswin")}'}
 
     # Call GET /files without geo/wifi - should be blocked (accessible False)
-    r = requests.get(f"{BASE_URL}/files", headers=headers)
+    r = SESSION.get(f"{BASE_URL}/files", headers=headers)
     assert r.status_code == 200
     files = r.json()
     assert all(not f['accessible'] for f in files)
 
     # Attempt to access a file without geo/wifi - should be 403
     file_id = files[0]['file_id']
-    r = requests.post(f"{BASE_URL}/files/access", headers=headers, json={'file_id': file_id})
+    r = SESSION.post(f"{BASE_URL}/files/access", headers=headers, json={'file_id': file_id})
     assert r.status_code == 403
 
 
 def test_admin_approval_normalizes_tz_and_sets_access_window():
-    client = MongoClient('mongodb://localhost:27017')
-    db = client['test_database']
-    # Set OTP for admin and verify
     now = datetime.now(timezone.utc)
-    db.users.update_one({'username':'admin'}, {'$set': {'otp': '444444', 'otp_expiry': (now+timedelta(minutes=10)).isoformat(), 'otp_sent_at':now.isoformat()}}, upsert=True)
-    r = requests.post(f"{BASE_URL}/auth/verify-otp", json={'username':'admin', 'otp':'444444'})
-    assert r.status_code == 200
-    token = r.json().get('access_token')
-    headers = {'Authorization': f'Bearer {token}'}
+    start = now - timedelta(minutes=5)
+    end = now + timedelta(minutes=30)
+    admin_token, aswin_token = get_tokens('admin', 'aswin')
+    headers = {'Authorization': f'Bearer {admin_token}'}
 
     # Create a pending WFH request for aswin first
-    # Ensure aswin has a valid OTP and login to get token
-    now = datetime.now(timezone.utc)
-    db.users.update_one({'username':'aswin'}, {'$set': {'otp': '555555', 'otp_expiry': (now+timedelta(minutes=10)).isoformat(), 'otp_sent_at':now.isoformat()}}, upsert=True)
-    r = requests.post(f"{BASE_URL}/auth/verify-otp", json={'username':'aswin', 'otp':'555555'})
-    assert r.status_code == 200
-    emp_token = r.json().get('access_token')
-    emp_headers = {'Authorization': f'Bearer {emp_token}'}
-    r = requests.post(f"{BASE_URL}/wfh-request", headers=emp_headers, json={'reason':'Testing approval'})
+    emp_headers = {'Authorization': f'Bearer {aswin_token}'}
+    r = SESSION.post(f"{BASE_URL}/wfh-request", headers=emp_headers, json={'reason':'Testing approval'})
     assert r.status_code == 200
 
     # Approve aswin's WFH with a timezone-specified start/end
-    start = (now - timedelta(minutes=5)).astimezone().isoformat()
-    end = (now + timedelta(minutes=30)).astimezone().isoformat()
-    r = requests.put(f"{BASE_URL}/admin/wfh-requests/aswin", headers=headers, json={'status':'approved','access_start':start,'access_end':end})
+    r = SESSION.put(f"{BASE_URL}/admin/wfh-requests/aswin", headers=headers, json={'status':'approved','access_start':start.astimezone().isoformat(),'access_end':end.astimezone().isoformat()})
     assert r.status_code == 200
 
     # Verify stored values are timezone normalized in DB
-    req = db.wfh_requests.find_one({'employee_username':'aswin','status':'approved'})
+    req = DB.wfh_requests.find_one({'employee_username':'aswin','status':'approved'})
     assert req is not None
     assert 'access_start' in req and 'access_end' in req
-    # They should be stored with timezone info - i.e., include '+' or 'Z'
-    assert '+' in req['access_start'] or 'Z' in req['access_start']
-    assert '+' in req['access_end'] or 'Z' in req['access_end']
+    # They should be stored as native dates holding the UTC-normalized instant
+    assert isinstance(req['access_start'], datetime) and isinstance(req['access_end'], datetime)
+    assert abs(req['access_start'].replace(tzinfo=timezone.utc) - start) < timedelta(seconds=1)
+    assert abs(req['access_end'].replace(tzinfo=timezone.utc) - end) < timedelta(seconds=1)
+
+
+def teardown_module(module):
+    SESSION.close()
+    CLIENT.close()